@@ -1,18 +1,60 @@
+import io
 import os
 import re
 import json
+import posixpath
 from pathlib import Path
+from functools import lru_cache
 
 from PIL import Image, ImageDraw
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 __all__ = ['diff_summary', 'assert_existence', 'patch_summary', 'apply_regex',
-           'remove_specific_hashes', 'transform_hashes', 'transform_images']
+           'apply_regex_to_summary', 'remove_specific_hashes',
+           'remove_specific_hashes_from_summary', 'transform_hashes', 'transform_images',
+           'load_json', 'load_json_cached', 'load_patches']
+
+
+def load_json(path):
+    """Load a JSON file, using orjson if it is available."""
+    data = Path(path).read_bytes()
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass  # orjson rejects the NaN and Infinity written by json.dump
+    return json.loads(data)
+
+
+@lru_cache(maxsize=64)
+def _load_json_cached(path, mtime, size):
+    return load_json(path)
+
+
+def load_json_cached(path):
+    """Load a JSON file, reusing the parsed result until the file is modified.
+
+    The returned object is shared between callers, so it must not be mutated.
+    """
+    path = Path(path)
+    stat = path.stat()
+    return _load_json_cached(str(path), stat.st_mtime_ns, stat.st_size)
 
 
 class MatchError(Exception):
     pass
 
 
+@lru_cache(maxsize=512)
+def _compile_regex(pattern):
+    """Compile a regex pattern, caching it for reuse across tests."""
+    return re.compile(pattern)
+
+
 def diff_summary(baseline, result, baseline_hash_library=None, result_hash_library=None,
                  generating_hashes=False):
     """Diff a pytest-mpl summary dictionary.
@@ -37,14 +79,12 @@ def diff_summary(baseline, result, baseline_hash_library=None, result_hash_libra
     """
     if baseline_hash_library and baseline_hash_library.exists():
         # Load "correct" baseline hashes
-        with open(baseline_hash_library, 'r') as f:
-            baseline_hash_library = json.load(f)
+        baseline_hash_library = load_json_cached(baseline_hash_library)
     else:
         baseline_hash_library = {}
     if result_hash_library and result_hash_library.exists():
         # Load "correct" result hashes
-        with open(result_hash_library, 'r') as f:
-            result_hash_library = json.load(f)
+        result_hash_library = load_json_cached(result_hash_library)
     else:
         result_hash_library = {}
 
@@ -55,49 +95,62 @@ def diff_summary(baseline, result, baseline_hash_library=None, result_hash_libra
     # Test names must be identical
     diff_set(baseline_tests, result_tests, error='Test names are not identical.')
 
-    item_match_errors = []  # Raise a MatchError for all mismatched values at the end
+    # Hash libraries to take the baseline and result hashes from (same for all tests)
+    hash_sources = []
+    if generating_hashes:  # Newly generate result will appear as baseline_hash
+        if result_hash_library:
+            hash_sources.append(('baseline_hash', result_hash_library.get))
+    elif baseline_hash_library:
+        hash_sources.append(('baseline_hash', baseline_hash_library.get))
+    if result_hash_library:
+        hash_sources.append(('result_hash', result_hash_library.get))
 
-    for test in baseline_tests:
+    # Raise a MatchError for all mismatched values at the end
+    item_match_errors = io.StringIO()
+    errors_write = item_match_errors.write
 
-        # Get baseline and result summary for the specific test
-        baseline_summary = baseline[test]
-        result_summary = result[test]
+    for test, baseline_summary in baseline.items():
 
         # Swap the baseline and result hashes in the summary
         # for the corresponding hashes in each hash library
-        if baseline_hash_library and test in baseline_hash_library and not generating_hashes:
-            baseline_summary = replace_hash(baseline_summary, 'baseline_hash',
-                                            baseline_hash_library[test])
-        if result_hash_library:
-            if generating_hashes:  # Newly generate result will appear as baseline_hash
-                baseline_summary = replace_hash(baseline_summary, 'baseline_hash',
-                                                result_hash_library[test])
-            baseline_summary = replace_hash(baseline_summary, 'result_hash',
-                                            result_hash_library[test])
-
-        # Get keys of recorded items
-        baseline_keys = set(baseline_summary.keys())
-        result_keys = set(result_summary.keys())
-
-        # Summaries must have the same keys
-        diff_set(baseline_keys, result_keys, error=f'Summary for {test} is not identical.')
-
-        for key in baseline_keys:
-            error = f'Summary item {key} for {test} does not match.\n'
-            try:
-                diff_dict_item(baseline_summary[key], result_summary[key], error=error)
-            except MatchError as e:
-                item_match_errors.append(str(e))
-
-    if len(item_match_errors) > 0:
-        raise MatchError('\n\n----------\n\n'.join(item_match_errors))
+        # (only hashes which actually differ are replaced)
+        new_hashes = {}
+        for hash_key, get_hash in hash_sources:
+            new_hash = get_hash(test)
+            if new_hash is not None and baseline_summary.get(hash_key) != new_hash:
+                new_hashes[hash_key] = new_hash
+        if new_hashes:
+            replace_hashes(baseline_summary, new_hashes)
+
+        for message in _diff_test(test, baseline_summary, result[test]):
+            if item_match_errors.tell() > 0:
+                errors_write('\n\n----------\n\n')
+            errors_write(message)
+
+    if item_match_errors.tell() > 0:
+        raise MatchError(item_match_errors.getvalue())
+
+
+def _diff_test(test, baseline_summary, result_summary):
+    """Yield the mismatched items between the summaries of a single test."""
+    # Summaries must have the same keys
+    diff_set(baseline_summary.keys(), result_summary.keys(),
+             error=f'Summary for {test} is not identical.')
+
+    for key, baseline_item in baseline_summary.items():
+        error = f'Summary item {key} for {test} does not match.\n'
+        try:
+            diff_dict_item(baseline_item, result_summary[key], error=error)
+        except MatchError as e:
+            yield str(e)
 
 
 def diff_set(baseline, result, error=''):
     """Raise and show the difference between Python sets."""
     if baseline != result:
-        missing_from_result = baseline - result
-        missing_from_baseline = result - baseline
+        difference = baseline ^ result
+        missing_from_result = [k for k in difference if k in baseline]
+        missing_from_baseline = [k for k in difference if k not in baseline]
         if len(missing_from_result) > 0:
             error += f'\nKeys {sorted(missing_from_result)} missing from the result.'
         if len(missing_from_baseline) > 0:
@@ -105,74 +158,108 @@ def diff_set(baseline, result, error=''):
         raise MatchError(error)
 
 
+def _match_str(baseline, result):
+    # Handle regex in baseline string (so things like paths can be ignored)
+    if baseline.startswith('REGEX:'):
+        if _compile_regex(baseline[6:]).fullmatch(result) is not None:
+            return True
+    return baseline == result
+
+
+def _match_identity(baseline, result):
+    return baseline is result
+
+
+def _match_equal(baseline, result):
+    return baseline == result
+
+
+def _match_float(baseline, result):
+    return abs(baseline - result) < 1e-4 or baseline == result
+
+
+# Comparison functions for each type of item in a summary
+_MATCHERS = {
+    str: _match_str,
+    bool: _match_identity,
+    type(None): _match_identity,
+    int: _match_equal,
+    float: _match_float,
+}
+
+
+def _item_error(error, baseline, result):
+    return error + f'Baseline:\n"{baseline}"\n\nResult:\n"{result}"\n'
+
+
 def diff_dict_item(baseline, result, error=''):
     """Diff a specific item in a pytest-mpl summary dictionary."""
-    # Comparison makes the following (good) assumptions
-    expected_types = (str, int, float, bool, type(None))
-    assert isinstance(baseline, expected_types)
-    assert isinstance(result, expected_types)
+    # Matching items must have the same type
+    item_type = type(baseline)
+    if item_type is not type(result):
+        raise MatchError(_item_error(error, baseline, result) + '\nTypes are not equal.\n')
 
-    # Prepare error message
-    error += f'Baseline:\n"{baseline}"\n\n'
-    error += f'Result:\n"{result}"\n'
+    # Only the types in _MATCHERS are expected in a summary
+    match = _MATCHERS.get(item_type)
+    if match is None:
+        raise MatchError(_item_error(error, baseline, result) + '\nUnexpected type.\n')
 
-    # Matching items must have the same type
-    if type(baseline) is not type(result):
-        raise MatchError(error + '\nTypes are not equal.\n')
+    if not match(baseline, result):
+        raise MatchError(_item_error(error, baseline, result))
 
-    # Handle regex in baseline string (so things like paths can be ignored)
-    if isinstance(baseline, str) and baseline.startswith('REGEX:'):
-        if re.fullmatch(baseline[6:], result) is not None:
-            return
 
-    # Handle bool and NoneType
-    if isinstance(baseline, (bool, type(None))) and baseline is result:
-        return
+def load_patches(path):
+    """Load all the `*.patch.json` files in a directory.
 
-    # Handle float
-    if isinstance(baseline, float) and abs(baseline - result) < 1e-4:
-        return
+    The patches are loaded once, and keyed by file name without the extension.
+    """
+    return _load_patches(str(path))
 
-    # Handle str and int
-    if baseline == result:
-        return
 
-    raise MatchError(error)
+@lru_cache(maxsize=None)
+def _load_patches(path):
+    return {file.name[:-len('.patch.json')]: load_json(file)
+            for file in Path(path).glob('*.patch.json')}
 
 
-def patch_summary(summary, patch_file):
-    """Replace in `summary` any items defined in `patch_file`."""
+def patch_summary(summary, patch):
+    """Replace in `summary` any items defined in the `patch` dictionary."""
     # By only applying patches, changes between MPL versions are more obvious.
-    with open(patch_file, 'r') as f:
-        patch = json.load(f)
     for test, test_summary in patch.items():
         for k, v in test_summary.items():
             summary[test][k] = v
     return summary
 
 
-def replace_hash(summary, hash_key, new_hash):
-    """Replace a hash in a pytest-mpl summary with a different hash.
+def replace_hashes(summary, new_hashes):
+    """Replace hashes in a pytest-mpl summary with different hashes, in place.
+
+    The old hashes are replaced in `status_msg` in a single pass.
 
     Parameters
     ----------
     summary : dict
         A single test from a pytest-mpl summary.
-    hash_key : str
-        Key of the hash. Either `baseline_hash` or `result_hash`.
-    new_hash : str
-        The new hash.
+    new_hashes : dict
+        The new hashes, keyed by either `baseline_hash` or `result_hash`.
     """
-    assert isinstance(new_hash, str)
-    old_hash = summary[hash_key]
-    if not isinstance(old_hash, str) or old_hash == new_hash:
-        return summary  # Either already correct or missing
+    replacements = {}
+    for hash_key, new_hash in new_hashes.items():
+        assert isinstance(new_hash, str)
+        old_hash = summary[hash_key]
+        if not isinstance(old_hash, str) or old_hash == new_hash:
+            continue  # Either already correct or missing
 
-    # Update the hash
-    summary[hash_key] = new_hash
-    summary['status_msg'] = summary['status_msg'].replace(old_hash, new_hash)
+        # Update the hash
+        summary[hash_key] = new_hash
+        # (if both old hashes are the same, only the first hash is replaced in status_msg)
+        replacements.setdefault(old_hash, new_hash)
 
-    return summary
+    status_msg = summary['status_msg']
+    if any(old_hash in status_msg for old_hash in replacements):
+        # Longest first, so a hash containing another hash is replaced as a whole
+        pattern = '|'.join(map(re.escape, sorted(replacements, key=len, reverse=True)))
+        summary['status_msg'] = re.sub(pattern, lambda m: replacements[m.group()], status_msg)
 
 
 def assert_existence(summary, items=('baseline_image', 'diff_image', 'result_image'), path=''):
@@ -187,10 +274,22 @@ def assert_existence(summary, items=('baseline_image', 'diff_image', 'result_ima
     path : str or path_like, optional, default=''
         Path to results directory. Defaults to current directory.
     """
-    for test in summary.values():
-        for item in items:
-            if test[item] is not None:
-                assert (Path(path) / test[item]).exists()
+    names = [test[item] for test in summary.values() for item in items
+             if test[item] is not None]
+    if not names:
+        return
+
+    # List each directory containing images once, rather than checking each image separately
+    present = set()
+    for parent in {posixpath.dirname(name) for name in names}:
+        try:
+            with os.scandir(Path(path) / parent) as entries:
+                present.update(posixpath.join(parent, entry.name) for entry in entries)
+        except OSError:
+            pass  # Missing directory, so the images in it are reported below
+
+    for name in names:
+        assert name in present or (Path(path) / name).exists()
 
 
 def _escape_regex(msg):
@@ -237,6 +336,18 @@ def apply_regex(file, regex_paths, regex_strs):
     with open(file, 'r') as f:
         summary = json.load(f)
 
+    apply_regex_to_summary(summary, regex_paths, regex_strs)
+
+    with open(file, 'w') as f:
+        json.dump(summary, f, indent=2)
+
+
+def apply_regex_to_summary(summary, regex_paths, regex_strs):
+    """Convert all `status_msg` entries in a summary dictionary to regex, in place.
+
+    See `apply_regex` for a description of the parameters.
+    """
+
     for test in summary.keys():
 
         msg = summary[test]['status_msg']
@@ -257,9 +368,6 @@ def apply_regex(file, regex_paths, regex_strs):
 
         summary[test]['status_msg'] = msg
 
-    with open(file, 'w') as f:
-        json.dump(summary, f, indent=2)
-
 
 def remove_specific_hashes(summary_file):
     """Replace all hashes in a summary file with placeholder values.
@@ -268,12 +376,21 @@ def remove_specific_hashes(summary_file):
     separate files for each specific matplotlib version.
     """
 
-    baseline_placeholder = "###_BASELINE_HASH_###"
-    result_placeholder = "###_RESULT_HASH_###"
-
     with open(summary_file, "r") as f:
         summary = json.load(f)
 
+    remove_specific_hashes_from_summary(summary)
+
+    with open(summary_file, "w") as f:
+        json.dump(summary, f, indent=2)
+
+
+def remove_specific_hashes_from_summary(summary):
+    """Replace all hashes in a summary dictionary with placeholder values, in place."""
+
+    baseline_placeholder = "###_BASELINE_HASH_###"
+    result_placeholder = "###_RESULT_HASH_###"
+
     for test in summary.keys():
 
         # Get actual hashes
@@ -290,9 +407,6 @@ def remove_specific_hashes(summary_file):
             summary[test]["status_msg"] = \
                 summary[test]["status_msg"].replace(result, result_placeholder)
 
-    with open(summary_file, "w") as f:
-        json.dump(summary, f, indent=2)
-
 
 def transform_hashes(hash_file):
     """Make hash comparison tests fail correctly.
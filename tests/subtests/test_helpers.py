@@ -0,0 +1,21 @@
+import json
+
+from .helpers import load_patches, patch_summary
+
+
+def test_patch_summary(tmp_path):
+    patch = {'test_a': {'status': 'failed', 'rms': 12.5}}
+    (tmp_path / 'test_default_mpl38_ft261.patch.json').write_text(json.dumps(patch))
+    (tmp_path / 'test_default.json').write_text(json.dumps({}))  # not a patch
+
+    patches = load_patches(tmp_path)
+    assert patches == {'test_default_mpl38_ft261': patch}
+
+    summary = {
+        'test_a': {'status': 'passed', 'rms': None, 'tolerance': 2},
+        'test_b': {'status': 'passed', 'rms': None, 'tolerance': 2},
+    }
+    assert patch_summary(summary, patches['test_default_mpl38_ft261']) == {
+        'test_a': {'status': 'failed', 'rms': 12.5, 'tolerance': 2},
+        'test_b': {'status': 'passed', 'rms': None, 'tolerance': 2},
+    }
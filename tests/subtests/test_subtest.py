@@ -1,5 +1,6 @@
 import os
 import sys
+import copy
 import json
 import shutil
 import tempfile
@@ -8,17 +9,18 @@ from pathlib import Path
 
 import matplotlib.ft2font
 import pytest
-from packaging.version import Version
 
-from .helpers import (apply_regex, assert_existence, diff_summary, patch_summary,
-                      remove_specific_hashes, transform_hashes, transform_images)
+from .helpers import (apply_regex_to_summary, assert_existence, diff_summary, load_json,
+                      load_patches, patch_summary, remove_specific_hashes_from_summary,
+                      transform_hashes, transform_images)
 
 # Handle Matplotlib and FreeType versions
-MPL_VERSION = Version(matplotlib.__version__)
+MPL_MAJOR, MPL_MINOR = matplotlib.__version__.split('.')[:2]
 FTV = matplotlib.ft2font.__freetype_version__.replace('.', '')
-VERSION_ID = f"mpl{MPL_VERSION.major}{MPL_VERSION.minor}_ft{FTV}"
+VERSION_ID = f"mpl{MPL_MAJOR}{MPL_MINOR}_ft{FTV}"
 HASH_LIBRARY = Path(__file__).parent / 'subtest' / 'hashes' / (VERSION_ID + ".json")
 RESULT_LIBRARY = Path(__file__).parent / 'result_hashes' / (VERSION_ID + ".json")
+HASH_LIBRARY_EXISTS = HASH_LIBRARY.exists()
 HASH_LIBRARY_FLAG = rf'--mpl-hash-library={HASH_LIBRARY}'
 FULL_BASELINE_PATH = Path(__file__).parent / 'subtest' / 'baseline'
 
@@ -30,6 +32,8 @@ HASH_COMPARISON_MODE = ["-k", "hash"]
 # HYBRID_MODE = []
 
 TEST_FILE = Path(__file__).parent / 'subtest'
+TEST_FILE_STR = str(TEST_FILE)
+SUMMARIES_PATH = Path(__file__).parent / 'summaries'
 
 # Global settings to update baselines when running pytest
 # Note: when updating baseline make sure you don't commit "fixes"
@@ -87,22 +91,25 @@ def run_subtest(baseline_summary_name, tmp_path, args, summaries=None, xfail=Tru
     results_path.mkdir()
 
     # Configure the arguments to run the test
-    pytest_args = [sys.executable, '-m', 'pytest', str(TEST_FILE)]
+    pytest_args = [sys.executable, '-m', 'pytest', TEST_FILE_STR,
+                   '-p', 'pytest_mpl.plugin', '-p', 'no:cacheprovider']
     mpl_args = ['--mpl', rf'--mpl-results-path={results_path.as_posix()}',
                 f'--mpl-generate-summary={summaries}']
     if update_baseline:
         mpl_args += [rf'--mpl-generate-path={FULL_BASELINE_PATH}']
-        if HASH_LIBRARY.exists():
+        if HASH_LIBRARY_EXISTS:
             mpl_args += [rf'--mpl-generate-hash-library={HASH_LIBRARY}']
 
     # Run the test and record exit status
-    status = subprocess.call(pytest_args + mpl_args + args)
+    # (only the pytest-mpl plugin is needed, so don't autoload any others)
+    env = {**os.environ, 'PYTEST_DISABLE_PLUGIN_AUTOLOAD': '1'}
+    status = subprocess.call(pytest_args + mpl_args + args, env=env)
 
     # If updating baseline, don't check summaries
     if update_baseline:
         assert status == 0
         transform_images(FULL_BASELINE_PATH)  # Make image comparison tests fail correctly
-        if HASH_LIBRARY.exists():
+        if HASH_LIBRARY_EXISTS:
             shutil.copy(HASH_LIBRARY, RESULT_LIBRARY)
             transform_hashes(HASH_LIBRARY)  # Make hash comparison tests fail correctly
         pytest.skip("Skipping testing, since `update_baseline` is enabled.")
@@ -115,21 +122,22 @@ def run_subtest(baseline_summary_name, tmp_path, args, summaries=None, xfail=Tru
         assert status == 0
 
     # Load summaries
-    baseline_path = Path(__file__).parent / 'summaries'
-    baseline_file = baseline_path / (baseline_summary_name + '.json')
+    baseline_file = SUMMARIES_PATH / (baseline_summary_name + '.json')
     results_file = results_path / 'results.json'
+    result_summary = load_json(results_file)
     if update_summary:
-        shutil.copy(results_file, baseline_file)
-        apply_regex(baseline_file, REGEX_PATHS, REGEX_STRS)
-        remove_specific_hashes(baseline_file)
-    with open(baseline_file, 'r') as f:
-        baseline_summary = json.load(f)
-    with open(results_file, 'r') as f:
-        result_summary = json.load(f)
+        # Convert a copy of the result into the new baseline summary
+        baseline_summary = copy.deepcopy(result_summary)
+        apply_regex_to_summary(baseline_summary, REGEX_PATHS, REGEX_STRS)
+        remove_specific_hashes_from_summary(baseline_summary)
+        with open(baseline_file, 'w') as f:
+            json.dump(baseline_summary, f, indent=2)
+    else:
+        baseline_summary = load_json(baseline_file)
 
     # Apply version specific patches
-    patch = baseline_path / (baseline_summary_name + f'_{VERSION_ID}.patch.json')
-    if patch.exists():
+    patch = load_patches(SUMMARIES_PATH).get(f'{baseline_summary_name}_{VERSION_ID}')
+    if patch is not None:
         baseline_summary = patch_summary(baseline_summary, patch)
     # Note: version specific hashes should be handled by diff_summary instead
 
@@ -151,10 +159,8 @@ def run_subtest(baseline_summary_name, tmp_path, args, summaries=None, xfail=Tru
     # Compare the generated hash library to the expected hash library
     if has_result_hashes:
         assert result_hash_file.exists()
-        with open(RESULT_LIBRARY, "r") as f:
-            baseline = json.load(f)
-        with open(result_hash_file, "r") as f:
-            result = json.load(f)
+        baseline = load_json(RESULT_LIBRARY)
+        result = load_json(result_hash_file)
 
         # Baseline contains hashes for all subtests so remove ones not used
         for test in list(baseline.keys()):
@@ -173,19 +179,19 @@ def test_default(tmp_path):
     run_subtest('test_default', tmp_path, [*IMAGE_COMPARISON_MODE])
 
 
-@pytest.mark.skipif(not HASH_LIBRARY.exists(), reason="No hash library for this mpl version")
+@pytest.mark.skipif(not HASH_LIBRARY_EXISTS, reason="No hash library for this mpl version")
 def test_hash(tmp_path):
     run_subtest('test_hash', tmp_path, [HASH_LIBRARY_FLAG, *HASH_COMPARISON_MODE])
 
 
-@pytest.mark.skipif(not HASH_LIBRARY.exists(), reason="No hash library for this mpl version")
+@pytest.mark.skipif(not HASH_LIBRARY_EXISTS, reason="No hash library for this mpl version")
 def test_results_always(tmp_path):
     run_subtest('test_results_always', tmp_path,
                 [HASH_LIBRARY_FLAG, BASELINE_IMAGES_FLAG_ABS, '--mpl-results-always'],
                 has_result_hashes=True)
 
 
-@pytest.mark.skipif(not HASH_LIBRARY.exists(), reason="No hash library for this mpl version")
+@pytest.mark.skipif(not HASH_LIBRARY_EXISTS, reason="No hash library for this mpl version")
 def test_html(tmp_path):
     run_subtest('test_results_always', tmp_path,
                 [HASH_LIBRARY_FLAG, BASELINE_IMAGES_FLAG_ABS], summaries=['html'],
@@ -195,7 +201,7 @@ def test_html(tmp_path):
     assert (tmp_path / 'results' / 'styles.css').exists()
 
 
-@pytest.mark.skipif(not HASH_LIBRARY.exists(), reason="No hash library for this mpl version")
+@pytest.mark.skipif(not HASH_LIBRARY_EXISTS, reason="No hash library for this mpl version")
 def test_html_hashes_only(tmp_path):
     run_subtest('test_html_hashes_only', tmp_path,
                 [HASH_LIBRARY_FLAG, *HASH_COMPARISON_MODE],
@@ -212,7 +218,7 @@ def test_html_images_only(tmp_path):
     assert (tmp_path / 'results' / 'styles.css').exists()
 
 
-@pytest.mark.skipif(not HASH_LIBRARY.exists(), reason="No hash library for this mpl version")
+@pytest.mark.skipif(not HASH_LIBRARY_EXISTS, reason="No hash library for this mpl version")
 def test_basic_html(tmp_path):
     run_subtest('test_results_always', tmp_path,
                 [HASH_LIBRARY_FLAG, *BASELINE_IMAGES_FLAG_REL], summaries=['basic-html'],
@@ -220,7 +226,7 @@ def test_basic_html(tmp_path):
     assert (tmp_path / 'results' / 'fig_comparison_basic.html').exists()
 
 
-@pytest.mark.skipif(not HASH_LIBRARY.exists(), reason="No hash library for this mpl version")
+@pytest.mark.skipif(not HASH_LIBRARY_EXISTS, reason="No hash library for this mpl version")
 def test_generate(tmp_path):
     # generating hashes and images; no testing
     run_subtest('test_generate', tmp_path,
@@ -235,7 +241,7 @@ def test_generate_images_only(tmp_path):
                 [rf'--mpl-generate-path={tmp_path}', *IMAGE_COMPARISON_MODE], xfail=False)
 
 
-@pytest.mark.skipif(not HASH_LIBRARY.exists(), reason="No hash library for this mpl version")
+@pytest.mark.skipif(not HASH_LIBRARY_EXISTS, reason="No hash library for this mpl version")
 def test_generate_hashes_only(tmp_path):
     # generating hashes; testing images
     run_subtest('test_generate_hashes_only', tmp_path,
@@ -243,7 +249,7 @@ def test_generate_hashes_only(tmp_path):
                 generating_hashes=True)
 
 
-@pytest.mark.skipif(not HASH_LIBRARY.exists(), reason="No hash library for this mpl version")
+@pytest.mark.skipif(not HASH_LIBRARY_EXISTS, reason="No hash library for this mpl version")
 def test_html_generate(tmp_path):
     # generating hashes and images; no testing
     run_subtest('test_html_generate', tmp_path,
@@ -262,7 +268,7 @@ def test_html_generate_images_only(tmp_path):
     assert (tmp_path / 'results' / 'fig_comparison.html').exists()
 
 
-@pytest.mark.skipif(not HASH_LIBRARY.exists(), reason="No hash library for this mpl version")
+@pytest.mark.skipif(not HASH_LIBRARY_EXISTS, reason="No hash library for this mpl version")
 def test_html_generate_hashes_only(tmp_path):
     # generating hashes; testing images
     run_subtest('test_html_generate_hashes_only', tmp_path,
@@ -271,7 +277,7 @@ def test_html_generate_hashes_only(tmp_path):
     assert (tmp_path / 'results' / 'fig_comparison.html').exists()
 
 
-@pytest.mark.skipif(not HASH_LIBRARY.exists(), reason="No hash library for this mpl version")
+@pytest.mark.skipif(not HASH_LIBRARY_EXISTS, reason="No hash library for this mpl version")
 def test_html_run_generate_hashes_only(tmp_path):
     # generating hashes; testing hashes
     run_subtest('test_html_hashes_only', tmp_path,
@@ -282,6 +288,6 @@ def test_html_run_generate_hashes_only(tmp_path):
 
 
 # Run a hybrid mode test last so if generating hash libraries, it includes all the hashes.
-@pytest.mark.skipif(not HASH_LIBRARY.exists(), reason="No hash library for this mpl version")
+@pytest.mark.skipif(not HASH_LIBRARY_EXISTS, reason="No hash library for this mpl version")
 def test_hybrid(tmp_path):
     run_subtest('test_hybrid', tmp_path, [HASH_LIBRARY_FLAG, BASELINE_IMAGES_FLAG_ABS])